@@ -1,6 +1,5 @@
 from __future__ import annotations as _annotations
 
-import re
 import sys
 from dataclasses import dataclass
 from pathlib import Path
@@ -21,11 +20,18 @@ RECORD_TYPES = RecordType.__args__  # type: ignore
 
 @dataclass
 class Zone:
+    # _rr is the resource record built from this zone by the server along with the (host, type, answer) it was
+    # built from, cached so it's only rebuilt when the zone is edited
+    __slots__ = 'host', 'type', 'answer', '_rr'
+
     host: str
     type: RecordType
     answer: str | list[str | int]
     # TODO we could add ttl and other args here if someone wanted it
 
+    def __post_init__(self) -> None:
+        self._rr: Any = None
+
     @classmethod
     def from_raw(cls, index: int, data: Any) -> Zone:
         if not isinstance(data, dict) or data.keys() != {'host', 'type', 'answer'}:
@@ -43,7 +49,10 @@ class Zone:
 
         answer = data['answer']
         if isinstance(answer, str):
-            answer = re.sub(r'\s*\r?\n', '', answer)
+            if '\n' in answer:
+                # drop line breaks along with any whitespace before them, leading whitespace on a line is kept
+                *lines, last = answer.split('\n')
+                answer = ''.join([line.rstrip() for line in lines]) + last
         elif not isinstance(answer, list) or not all(isinstance(x, (str, int)) for x in answer):
             raise ValueError(
                 f'Zone {index} is invalid, "answer" must be a string or list of strings and ints, got {data!r}'
@@ -1,17 +1,18 @@
 from __future__ import annotations as _annotations
 
 import logging
+from contextlib import contextmanager
 from datetime import datetime
+from functools import lru_cache, partial
 from pathlib import Path
-from textwrap import wrap
-from threading import Lock
-from typing import Any, Dict, Generic, Iterable, List, Sequence, Tuple, TypeVar, overload
+from threading import Condition, Lock
+from typing import Any, Callable, Dict, Generic, Iterable, List, Tuple, TypeVar, overload
 
 from dnslib import QTYPE, RR, DNSLabel, DNSRecord, dns
 from dnslib.proxy import ProxyResolver as LibProxyResolver
 from dnslib.server import BaseResolver as LibBaseResolver, DNSHandler, DNSServer as LibDNSServer
 
-from .load_records import Records, Zone, load_records
+from .load_records import RECORD_TYPES, Records, Zone, load_records
 
 __all__ = 'DNSServer', 'logger'
 
@@ -41,46 +42,73 @@ TYPE_LOOKUP = {
     'TXT': (dns.TXT, QTYPE.TXT),
     'SPF': (dns.TXT, QTYPE.TXT),
 }
+# NS and SOA records change rarely so can be cached for longer
+TTL_LOOKUP = {type_: 3600 * 24 if rtype in (QTYPE.NS, QTYPE.SOA) else 300 for type_, (_, rtype) in TYPE_LOOKUP.items()}
+# sensible times to add to SOA records which only give the mname and rname
+SOA_TIMES = (SERIAL_NO, 3600, 3600 * 3, 3600 * 24, 3600)
+# everything needed to build an RR of each record type with a single lookup, raises here if a type is missing
+_RR_TYPES = {type_: (*TYPE_LOOKUP[type_], TTL_LOOKUP[type_]) for type_ in RECORD_TYPES}
 DEFAULT_PORT = 53
 DEFAULT_UPSTREAM = '1.1.1.1'
+QUERY_CACHE_SIZE = 1024
 
 
-class Record:
-    def __init__(self, zone: Zone):
-        self._rname = DNSLabel(zone.host)
+NameKey = Tuple[bytes, ...]
 
-        rd_cls, self._rtype = TYPE_LOOKUP[zone.type]
 
-        args: list[Any]
-        if isinstance(zone.answer, str):
-            if self._rtype == QTYPE.TXT:
-                args = [wrap(zone.answer, 255)]
-            else:
-                args = [zone.answer]
-        else:
-            if self._rtype == QTYPE.SOA and len(zone.answer) == 2:
-                # add sensible times to SOA
-                args = zone.answer + [(SERIAL_NO, 3600, 3600 * 3, 3600 * 24, 3600)]
-            else:
-                args = zone.answer
+def _name_key(label: DNSLabel) -> NameKey:
+    """
+    Lower cased label parts, hashes and compares like `DNSLabel` but without going through python for each part.
+    """
+    return tuple([part.lower() for part in label.label])
 
-        if self._rtype in (QTYPE.NS, QTYPE.SOA):
-            ttl = 3600 * 24
+
+def _build_rr(zone: Zone) -> RR:
+    rname = DNSLabel(zone.host)
+    rd_cls, rtype, ttl = _RR_TYPES[zone.type]
+
+    args: list[Any]
+    if isinstance(zone.answer, str):
+        if rtype == QTYPE.TXT:
+            # TXT strings are at most 255 bytes, longer answers are split into several strings
+            answer = zone.answer.encode()
+            args = [[answer[i : i + 255] for i in range(0, len(answer), 255)]]  # noqa: E203
         else:
-            ttl = 300
+            args = [zone.answer]
+    else:
+        if rtype == QTYPE.SOA and len(zone.answer) == 2:
+            args = zone.answer + [SOA_TIMES]
+        else:
+            args = zone.answer
 
-        self.rr = RR(
-            rname=self._rname,
-            rtype=self._rtype,
-            rdata=rd_cls(*args),
-            ttl=ttl,
-        )
+    return RR(
+        rname=rname,
+        rtype=rtype,
+        rdata=rd_cls(*args),
+        ttl=ttl,
+    )
 
-    def match(self, q):
-        return q.qname == self._rname and (q.qtype == QTYPE.ANY or q.qtype == self._rtype)
 
-    def sub_match(self, q):
-        return self._rtype == QTYPE.SOA and q.qname.matchSuffix(self._rname)
+def _zone_rr(zone: Zone) -> RR:
+    """
+    RR for a zone, reused until the zone is edited in place.
+    """
+    cached = zone._rr
+    if cached is None or cached[0] != (zone.host, zone.type, zone.answer):
+        answer = zone.answer if isinstance(zone.answer, str) else list(zone.answer)
+        cached = zone._rr = (zone.host, zone.type, answer), _build_rr(zone)
+    return cached[1]
+
+
+class Record:
+    __slots__ = 'rr', '_rname', '_rtype', '_name', '_key'
+
+    def __init__(self, zone: Zone):
+        self.rr = rr = _zone_rr(zone)
+        self._rname = rr.rname
+        self._rtype = rr.rtype
+        self._name = _name_key(self._rname)
+        self._key = self._name, self._rtype
 
     def __str__(self):
         return str(self.rr)
@@ -89,54 +117,174 @@ class Record:
 T = TypeVar('T')
 
 
+class RWLock:
+    """
+    Lock which can be held by any number of readers or by a single writer, waiting writers block new readers.
+
+    `acquire` and `release` (and so `with lock:`) take the lock for writing.
+
+    The lock is not reentrant, a thread holding it must not acquire it again, e.g. calling
+    `RecordsResolver.records()` inside `with shared:` deadlocks.
+    """
+
+    def __init__(self) -> None:
+        self._cond = Condition(Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire(self):
+        with self._cond:
+            self._writers_waiting += 1
+            acquired = False
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+                acquired = True
+            finally:
+                self._writers_waiting -= 1
+                if not acquired:
+                    # e.g. interrupted while waiting, wake the readers this writer was holding back
+                    self._cond.notify_all()
+            self._writer = True
+
+    def release(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
 class SharedObject(Generic[T]):
-    def __init__(self, obj: T, lock: Lock = None) -> None:
+    def __init__(self, obj: T, lock: 'RWLock | Lock | None' = None) -> None:
         self._obj = obj
-        self.lock = lock or Lock()
+        self.lock = lock or RWLock()
+        # bumped each time the object is released after write access, so readers can tell derived data is stale
+        self.version = 0
 
     def __enter__(self):
         self.lock.acquire()
         return self._obj
 
     def __exit__(self, exc_type, exc_value, traceback):
+        self.version += 1
         self.lock.release()
 
+    @contextmanager
+    def read(self):
+        """
+        Access the object without modifying it, `version` is left untouched.
+
+        With an `RWLock` any number of readers can hold it at once, any other lock is taken exclusively.
+        """
+        lock = self.lock
+        if isinstance(lock, RWLock):
+            lock.acquire_read()
+            try:
+                yield self._obj
+            finally:
+                lock.release_read()
+        else:
+            lock.acquire()
+            try:
+                yield self._obj
+            finally:
+                lock.release()
+
     def set(self, obj: T):
         with self:
             self._obj = obj
 
 
+Answers = Tuple[Tuple[RR, ...], bool]
+Finder = Callable[[NameKey, int], Answers]
+
+
 class RecordsResolver(LibBaseResolver):
     def __init__(self, records: SharedObject[Records]):
         self._records = records
-
-    def records(self):
-        with self._records as records:
-            return [Record(zone) for zone in records.zones]
-
-    def resolve(self, request: DNSRecord, handler: DNSHandler):
-        records = self.records()
-        type_name = QTYPE[request.q.qtype]
-        reply = request.reply()
-        for record in records:
-            if record.match(request.q):
-                reply.add_answer(record.rr)
-
-        if reply.rr:
-            logger.info('found zone for %s[%s], %d replies', request.q.qname, type_name, len(reply.rr))
-            return reply
+        self._snapshot: Tuple[int, Tuple[Record, ...], Finder] = (-1, (), partial(self._find, {}, []))
+
+    def snapshot(self) -> Tuple[Tuple[Record, ...], Finder]:
+        """
+        Immutable snapshot of the records, plus a function to find the answers to a query among them,
+        the last `QUERY_CACHE_SIZE` queries are cached.
+
+        The snapshot is rebuilt when the shared records have changed, otherwise it's returned without taking any lock.
+        """
+        version, records, find = self._snapshot
+        if version == self._records.version:
+            return records, find
+
+        with self._records.read() as shared_records:
+            version = self._records.version
+            records = tuple(Record(zone) for zone in shared_records.zones)
+            # keyed by (name, type) and by (name, ANY), so any query is answered with a single lookup
+            by_key: Dict[Tuple[NameKey, int], List[RR]] = {}
+            # (start of the suffix to compare, SOA name, RR) so higher level SOA matches are a slice and compare
+            soa: List[Tuple[int, NameKey, RR]] = []
+            for record in records:
+                by_key.setdefault(record._key, []).append(record.rr)
+                by_key.setdefault((record._name, QTYPE.ANY), []).append(record.rr)
+                if record._rtype == QTYPE.SOA:
+                    soa.append((-len(record._name), record._name, record.rr))
+            find = lru_cache(maxsize=QUERY_CACHE_SIZE)(partial(self._find, by_key, soa))
+            # published in one assignment so lock free readers see either the old or the new snapshot
+            self._snapshot = version, records, find
+        return records, find
+
+    def records(self) -> Tuple[Record, ...]:
+        return self.snapshot()[0]
+
+    @staticmethod
+    def _find(
+        by_key: Dict[Tuple[NameKey, int], List[RR]], soa: List[Tuple[int, NameKey, RR]], name: NameKey, qtype: int
+    ) -> Answers:
+        """
+        RRs answering a query, and whether they're for the name itself rather than a higher level SOA.
+        """
+        answers = by_key.get((name, qtype))
+        if answers:
+            return tuple(answers), True
 
         # no direct zone so look for an SOA record for a higher level zone
-        for record in records:
-            if record.sub_match(request.q):
-                reply.add_answer(record.rr)
+        return tuple([rr for start, suffix, rr in soa if name[start:] == suffix]), False
 
-        if reply.rr:
-            logger.info('found higher level SOA resource for %s[%s]', request.q.qname, type_name)
-            return reply
+    def resolve(self, request: DNSRecord, handler: DNSHandler):
+        _, find = self.snapshot()
+        q = request.q
+        answers, direct = find(_name_key(q.qname), q.qtype)
+        log = logger.isEnabledFor(logging.INFO)
+        if not answers:
+            if log:
+                logger.info('no local zone found %s[%s]', q.qname, QTYPE[q.qtype])
+            return request.reply()
 
-        logger.info('no local zone found %s[%s]', request.q.qname, type_name)
-        return request.reply()
+        reply = request.reply()
+        reply.add_answer(*answers)
+        if log:
+            if direct:
+                logger.info('found zone for %s[%s], %d replies', q.qname, QTYPE[q.qtype], len(answers))
+            else:
+                logger.info('found higher level SOA resource for %s[%s]', q.qname, QTYPE[q.qtype])
+        return reply
 
 
 class ProxyResolver(LibProxyResolver):
@@ -144,8 +292,8 @@ class ProxyResolver(LibProxyResolver):
         super().__init__(address=upstream, port=int(port or DEFAULT_PORT), timeout=int(timeout or 5))
 
     def resolve(self, request: DNSRecord, handler: DNSHandler):
-        type_name = QTYPE[request.q.qtype]
-        logger.info('proxying %s[%s]', request.q.qname, type_name)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('proxying %s[%s]', request.q.qname, QTYPE[request.q.qtype])
         return super().resolve(request, handler)
 
 
@@ -170,11 +318,45 @@ Port = Tuple[int, bool]
 
 
 def _ports(obj):
-    if isinstance(obj, Sequence):
-        if len(obj) == 2 and isinstance(obj[1], (bool, type(None))):
+    """
+    `(port, tcp)` if `obj` describes a single port, `None` if it's a collection of ports.
+    """
+    if isinstance(obj, (int, str)):
+        return (obj, None)
+    if isinstance(obj, (tuple, list)):
+        if len(obj) == 2 and (obj[1] is None or type(obj[1]) is bool):
             return (obj[0], obj[1])
         return None
-    return (obj, None)
+    try:
+        iter(obj)
+    except TypeError:
+        return (obj, None)
+    return None
+
+
+@lru_cache(maxsize=8)
+def _parse_zones(zones_file: str, mtime_ns: int, size: int, inode: int) -> Tuple[Tuple[str, str, Any], ...]:
+    """
+    Validated `(host, type, answer)` of the zones in a file, immutable so the cached value can't be modified.
+
+    `mtime_ns`, `size` and `inode` are only part of the cache key so the file is reloaded when it changes.
+    """
+    return tuple(
+        (zone.host, zone.type, zone.answer if isinstance(zone.answer, str) else tuple(zone.answer))
+        for zone in load_records(zones_file).zones
+    )
+
+
+def _load_zones(zones_file: 'str | Path') -> List[Zone]:
+    """
+    New zones from a file each time since servers can modify their records, parsing is cached while it's unchanged.
+    """
+    path = Path(zones_file).resolve()
+    stat = path.stat()
+    return [
+        Zone(host, type_, answer if isinstance(answer, str) else list(answer))
+        for host, type_, answer in _parse_zones(str(path), stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    ]
 
 
 class BaseDNSServer(Generic[R]):
@@ -219,27 +401,42 @@ class BaseDNSServer(Generic[R]):
             if tcp is None or tcp is True:
                 self.servers[(port, True)] = None
 
-        self.resolver = resolver or Records(zones=[])
-        if isinstance(self.resolver, Records):
-            self.resolver = SharedObject(self.resolver)
-        if isinstance(self.resolver, SharedObject):
-            self.resolver = RecordsResolver(self.resolver)
-        if isinstance(self.resolver, str):
+        resolver = resolver or Records(zones=[])
+        # exact type checks are cheap, isinstance is only needed for subclasses and to validate any other resolver
+        resolver_type = type(resolver)
+        if resolver_type is not Records and resolver_type is not SharedObject and resolver_type is not str:
+            if isinstance(resolver, Records):
+                resolver_type = Records
+            elif isinstance(resolver, SharedObject):
+                resolver_type = SharedObject
+            elif isinstance(resolver, str):
+                resolver_type = str
+            elif not isinstance(resolver, LibBaseResolver):
+                raise ValueError(resolver)
+
+        if resolver_type is Records:
+            resolver = SharedObject(resolver)
+            resolver_type = SharedObject
+        if resolver_type is SharedObject:
+            resolver = RecordsResolver(resolver)
+        elif resolver_type is str:
             resolvers = [ProxyResolver(*upstream.split(':')) for upstream in resolver.split(',')]
             if len(resolvers) > 1:
-                self.resolver = RoundRobinResolver(resolvers)
+                resolver = RoundRobinResolver(resolvers)
             else:
-                self.resolver = resolvers[0]
-
-        if not isinstance(self.resolver, LibBaseResolver):
-            raise ValueError(self.resolver)
+                resolver = resolvers[0]
+        self.resolver = resolver
 
     def start(self):
-        for port, tcp in self.servers:
-            logger.info('starting DNS server on port %d protocol: %s', port, 'tcp' if tcp else 'udp')
-            server = LibDNSServer(self.resolver, port=port, tcp=tcp)
+        servers = self.servers
+        resolver = self.resolver
+        for key in list(servers):
+            port, tcp = key
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('starting DNS server on port %d protocol: %s', port, 'tcp' if tcp else 'udp')
+            server = LibDNSServer(resolver, port=port, tcp=tcp)
             server.start_thread()
-            self.servers[(port, tcp)] = server
+            servers[key] = server
 
     def stop(self):
         for server in self.servers.values():
@@ -248,10 +445,7 @@ class BaseDNSServer(Generic[R]):
 
     @property
     def is_running(self):
-        for server in self.servers.values():
-            if server.isAlive():
-                return True
-        return False
+        return any(server is not None and server.isAlive() for server in self.servers.values())
 
     @property
     def port(self):
@@ -286,7 +480,7 @@ class DNSServer(BaseDNSServer['RoundRobinResolver[RecordsResolver | ProxyResolve
         port: 'int | str | None' = DEFAULT_PORT,
         upstream: 'str | None' = DEFAULT_UPSTREAM,
     ) -> 'DNSServer':
-        records = load_records(zones_file)
+        records = Records(_load_zones(zones_file))
         logger.info(
             'loaded %d zone record from %s, with %s as a proxy DNS server',
             len(records.zones),
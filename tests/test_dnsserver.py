@@ -1,11 +1,17 @@
+import os
+from threading import Barrier, BrokenBarrierError, Event, Lock, Thread
+from time import sleep
 from typing import Any, Callable, Dict, List
 
 import dns
 import pytest
 from dirty_equals import IsIP, IsPositive
 from dns.resolver import NoAnswer, Resolver as RawResolver
+from dnslib import DNSRecord
 
 from dnserver import DNSServer, Zone
+from dnserver.load_records import Records
+from dnserver.main import BaseDNSServer, ProxyResolver, RecordsResolver, RWLock, SharedObject, _parse_zones
 
 Resolver = Callable[[str, str], List[Dict[str, Any]]]
 
@@ -66,6 +72,15 @@ def test_a_record(dns_resolver: Resolver):
     ]
 
 
+def test_record_case_insensitive(dns_resolver: Resolver):
+    assert dns_resolver('EXAMPLE.Com', 'A') == [
+        {
+            'type': 'A',
+            'value': '1.2.3.4',
+        },
+    ]
+
+
 def test_cname_record(dns_resolver: Resolver):
     assert dns_resolver('example.com', 'CNAME') == [
         {
@@ -95,6 +110,27 @@ def test_mx_record(dns_resolver: Resolver):
     ]
 
 
+def test_txt_record(dns_resolver: Resolver):
+    assert dns_resolver('example.com', 'TXT') == [
+        {
+            'type': 'TXT',
+            'value': '"hello this is some text"',
+        },
+    ]
+    long_value = (
+        'one long value: IICIjANBgkqhkiG9w0BAQEFAAOCAg8AMIICCgKCAgFWZUed1qcBziAsqZ/LzT2ASxJYuJ5sko1CzWFhFu'
+        'xiluNnwKjSknSjanyYnm0vro4dhAtyiQ7OPVROOaNy9Iyklvu91KuhbYi6l80Rrdnuq1yjM//xjaB6DGx8+m1ENML8PEdSFbK'
+        'Qbh9akm2bkNw5DC5a8Slp7j+eEVHkgV3k3oRhkPcrKyoPVvniDNH+Ln7DnSGC+Aw5Sp+fhu5aZmoODhhX5/1mANBgkqhkiG9w'
+        '0BAQEFAAOCAg8AMIICCgKCAgEA26JaFWZUed1qcBziAsqZ/LzTF2ASxJYuJ5sk'
+    )
+    assert dns_resolver('testing.com', 'TXT') == [
+        {
+            'type': 'TXT',
+            'value': f'"{long_value[:255]}" "{long_value[255:]}"',
+        },
+    ]
+
+
 def test_proxy(dns_resolver: Resolver):
     assert dns_resolver('example.org', 'A') == [
         {
@@ -197,6 +233,214 @@ def test_dynamic_zone_update(dns_server: DNSServer, dns_resolver: Resolver):
         dns_resolver('another-example.org', 'A')
 
 
+def test_from_toml_cached(tmp_path):
+    _parse_zones.cache_clear()
+    path = tmp_path / 'zones.toml'
+    path.write_text('[[zones]]\nhost = "example.com"\ntype = "MX"\nanswer = ["whatever.com.", 5]\n')
+    server = DNSServer.from_toml(path, upstream=None)
+    assert _parse_zones.cache_info()[:2] == (0, 1)
+    with server.records as records:
+        assert records.zones == [Zone(host='example.com', type='MX', answer=['whatever.com.', 5])]
+        records.zones[0].host = 'evil.com'
+        records.zones[0].answer.append(10)
+
+    server.add_record(Zone(host='another-example.com', type='A', answer='2.3.4.5'))
+    with DNSServer.from_toml(path, upstream=None).records as records:
+        assert records.zones == [Zone(host='example.com', type='MX', answer=['whatever.com.', 5])]
+    # unchanged file, so not parsed again
+    assert _parse_zones.cache_info()[:2] == (1, 1)
+
+    # a rewrite within the same mtime tick is still picked up
+    stat = path.stat()
+    path.write_text('[[zones]]\nhost = "example.com"\ntype = "A"\nanswer = "4.5.6.7"\n')
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with DNSServer.from_toml(path, upstream=None).records as records:
+        assert records.zones == [Zone(host='example.com', type='A', answer='4.5.6.7')]
+    assert _parse_zones.cache_info()[:2] == (1, 2)
+
+
+def test_resolver_subclasses():
+    class MyRecords(Records):
+        pass
+
+    class MySharedObject(SharedObject):
+        pass
+
+    class MyStr(str):
+        pass
+
+    zones = [Zone(host='example.com', type='A', answer='1.2.3.4')]
+    assert type(BaseDNSServer(MyRecords(zones=zones)).resolver) is RecordsResolver
+    assert type(BaseDNSServer(MySharedObject(Records(zones=zones))).resolver) is RecordsResolver
+    assert type(BaseDNSServer(MyStr('1.1.1.1')).resolver) is ProxyResolver
+    with pytest.raises(ValueError):
+        BaseDNSServer(42)
+
+
+def test_shared_object_plain_lock():
+    lock = Lock()
+    shared = SharedObject(Records(zones=[Zone(host='example.com', type='A', answer='1.2.3.4')]), lock)
+    with shared.read() as records:
+        assert lock.locked()
+        assert len(records.zones) == 1
+    assert not lock.locked()
+    assert shared.version == 0
+
+    server = DNSServer(shared, upstream=None)
+    server.add_record(Zone(host='another-example.com', type='A', answer='2.3.4.5'))
+    assert shared.version == 1
+    reply = server.resolver.resolve(DNSRecord.question('another-example.com', 'A'), None)
+    assert [str(rr.rdata) for rr in reply.rr] == ['2.3.4.5']
+
+
+def test_shared_object_readers_together():
+    shared = SharedObject(Records(zones=[]))
+    # only passable once both readers are inside read() at the same time
+    barrier = Barrier(2, timeout=5)
+    results = []
+
+    def reader():
+        with shared.read():
+            try:
+                barrier.wait()
+            except BrokenBarrierError:
+                results.append(False)
+            else:
+                results.append(True)
+
+    threads = [Thread(target=reader) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert results == [True, True]
+
+
+def test_shared_object_writer_excluded():
+    shared = SharedObject(Records(zones=[]))
+    written = Event()
+
+    def writer():
+        with shared as records:
+            records.zones.append(Zone(host='example.com', type='A', answer='1.2.3.4'))
+        written.set()
+
+    with shared.read():
+        thread = Thread(target=writer)
+        thread.start()
+        assert not written.wait(0.1)
+        assert shared.version == 0
+    assert written.wait(5)
+    thread.join(5)
+    assert shared.version == 1
+
+
+def test_shared_object_waiting_writer_blocks_readers():
+    shared = SharedObject(Records(zones=[]))
+    events = []
+
+    def writer():
+        with shared:
+            events.append('write')
+
+    def reader():
+        with shared.read():
+            events.append('read')
+
+    with shared.read():
+        writer_thread = Thread(target=writer)
+        writer_thread.start()
+        for _ in range(500):
+            if shared.lock._writers_waiting:
+                break
+            sleep(0.01)
+        reader_thread = Thread(target=reader)
+        reader_thread.start()
+        sleep(0.1)
+        assert events == []
+    writer_thread.join(5)
+    reader_thread.join(5)
+    assert events == ['write', 'read']
+
+
+def test_shared_object_version():
+    shared = SharedObject(Records(zones=[]))
+    with shared.read():
+        pass
+    assert shared.version == 0
+    with shared as records:
+        records.zones.append(Zone(host='example.com', type='A', answer='1.2.3.4'))
+        assert shared.version == 0
+    assert shared.version == 1
+    shared.set(Records(zones=[]))
+    assert shared.version == 2
+
+
+def test_rwlock_writer_interrupted():
+    lock = RWLock()
+    lock.acquire_read()
+
+    def wait():
+        raise KeyboardInterrupt
+
+    lock._cond.wait = wait
+    with pytest.raises(KeyboardInterrupt):
+        lock.acquire()
+    del lock._cond.wait
+
+    # the writer gave up, so new readers aren't held back by it
+    lock.acquire_read()
+    lock.release_read()
+    lock.release_read()
+    lock.acquire()
+    lock.release()
+
+
+def test_zone_edited_in_place():
+    server = DNSServer(Records(zones=[Zone(host='example.com', type='A', answer='1.2.3.4')]), upstream=None)
+
+    def resolve() -> List[str]:
+        reply = server.resolver.resolve(DNSRecord.question('example.com', 'A'), None)
+        return [str(rr.rdata) for rr in reply.rr]
+
+    assert resolve() == ['1.2.3.4']
+    with server.records as records:
+        records.zones[0].answer = '5.6.7.8'
+    assert resolve() == ['5.6.7.8']
+
+
+def test_query_cache():
+    server = DNSServer(Records(zones=[Zone(host='example.com', type='A', answer='1.2.3.4')]), upstream=None)
+
+    def resolve(name: str) -> List[str]:
+        reply = server.resolver.resolve(DNSRecord.question(name, 'A'), None)
+        return [str(rr.rdata) for rr in reply.rr]
+
+    assert resolve('example.com') == ['1.2.3.4']
+    assert resolve('example.com') == ['1.2.3.4']
+    _, find = server.resolver.snapshot()
+    assert find.cache_info()[:2] == (1, 1)
+
+    server.add_record(Zone(host='another-example.com', type='A', answer='2.3.4.5'))
+    assert resolve('another-example.com') == ['2.3.4.5']
+    _, new_find = server.resolver.snapshot()
+    assert new_find is not find
+    assert new_find.cache_info()[:2] == (0, 1)
+    assert find.cache_info()[:2] == (1, 1)
+
+    server.set_records([Zone(host='example.com', type='A', answer='4.5.6.7')])
+    assert resolve('example.com') == ['4.5.6.7']
+    _, find = server.resolver.snapshot()
+    assert find.cache_info()[:2] == (0, 1)
+
+    with server.records as records:
+        records.zones[0].answer = '5.6.7.8'
+    assert resolve('example.com') == ['5.6.7.8']
+    _, new_find = server.resolver.snapshot()
+    assert new_find is not find
+    assert new_find.cache_info()[:2] == (0, 1)
+
+
 def test_no_zone_at_initialization():
     port = 5055
 
@@ -216,3 +460,20 @@ def test_no_zone_at_initialization():
             resolve('example.com', 'A')
     finally:
         server.stop()
+
+
+@pytest.mark.parametrize(
+    'port,servers',
+    [
+        (5053, [(5053, False), (5053, True)]),
+        ('5053', [(5053, False), (5053, True)]),
+        ((5053, True), [(5053, True)]),
+        ([5053, 5054], [(5053, False), (5053, True), (5054, False), (5054, True)]),
+        ([(5053, False), 5054], [(5053, False), (5054, False), (5054, True)]),
+        ({5053}, [(5053, False), (5053, True)]),
+    ],
+)
+def test_ports(port, servers):
+    server = DNSServer(port=port, upstream=None)
+    assert list(server.servers) == servers
+    assert not server.is_running
@@ -38,6 +38,23 @@ def test_create_server():
     [Record(zone) for zone in records.zones]
 
 
+def test_record_rr_cached():
+    zone = Zone(host='example.com', type='A', answer='1.2.3.4')
+    rr = Record(zone).rr
+    assert Record(zone).rr is rr
+    assert zone == Zone(host='example.com', type='A', answer='1.2.3.4')
+
+
+def test_record_rr_zone_edited():
+    zone = Zone(host='example.com', type='MX', answer=['whatever.com.', 5])
+    rr = Record(zone).rr
+    zone.answer[1] = 10
+    assert Record(zone).rr is not rr
+    assert Record(zone).rr.rdata.preference == 10
+    zone.host = 'another-example.com'
+    assert str(Record(zone).rr.rname) == 'another-example.com.'
+
+
 def test_no_zones(tmp_path):
     path = tmp_path / 'zones.toml'
     path.write_text('x = 4')
@@ -65,3 +82,17 @@ def test_invalid_zones(tmp_path, toml, error):
     path.write_text(toml)
     with pytest.raises(ValueError, match=error):
         load_records(path)
+
+
+@pytest.mark.parametrize(
+    'answer,expected',
+    [
+        ('1.2.3.4', '1.2.3.4'),
+        ('\none\ntwo\n', 'onetwo'),
+        ('one  \r\ntwo\t\n', 'onetwo'),
+        ('one \n \n  two ', 'one  two '),
+    ],
+)
+def test_answer_newlines(answer, expected):
+    zone = Zone.from_raw(1, {'host': 'example.com', 'type': 'TXT', 'answer': answer})
+    assert zone.answer == expected